@@ -2,13 +2,38 @@
 # app.py (Final Version with Timestamp Fix)
 #
 import os
-import json
 import base64
+import collections
 import logging
 import datetime
-import pandas as pd
-from flask import Flask, Response
+import decimal
+import functools
+import hashlib
+import io
+import itertools
+import multiprocessing
+import operator
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pyarrow as pa
+import pyarrow.compute as pc
+from flask import Flask, Response, request
 from flask_cors import CORS
+from werkzeug.wsgi import ClosingIterator
+
+# The connector picks its OCSP response cache directory when it is imported.
+# Keep it on a known writable path (point it at a persistent volume to survive
+# restarts) so new workers reuse validated responses instead of paying the
+# OCSP round-trips on their first connection.
+OCSP_CACHE_DIR = os.environ.setdefault(
+    'SF_OCSP_RESPONSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sf_ocsp')
+)
+os.makedirs(OCSP_CACHE_DIR, exist_ok=True)
 import snowflake.connector
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
@@ -16,75 +41,273 @@ from cryptography.hazmat.backends import default_backend
 # --- Setup ---
 app = Flask(__name__)
 CORS(app)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Per-request messages are DEBUG; set LOG_LEVEL=WARNING to keep only problems
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+logger = logging.getLogger(__name__)
+
+# --- JSON Serializer for types the encoder does not handle natively ---
+_CONVERTERS = {
+    datetime.date: operator.methodcaller('isoformat'),
+    decimal.Decimal: float,
+}
 
-# --- JSON Serializer for Datetime/Timestamp objects ---
 def json_converter(o):
     """
-    This function is a custom converter for the json.dumps() method.
-    It checks if an object is a datetime or pandas Timestamp and converts it to a
-    standard ISO 8601 string format, which is JSON serializable.
+    Fallback converter passed as `default=` to json_dumps().
+    orjson serializes plain datetime/date and numpy values natively; only
+    subclasses (e.g. the pandas Timestamp pyarrow returns for nanosecond
+    columns) end up here and are converted to an ISO 8601 string. Decimals
+    (Arrow decimal128 columns) become floats, which matches what the previous
+    pandas path produced.
     """
-    if isinstance(o, (datetime.datetime, datetime.date, pd.Timestamp)):
-        return o.isoformat()
-    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+    convert = _CONVERTERS.get(type(o))
+    if convert is None:
+        # First time this exact type is seen: resolve through its base classes
+        # and remember the result, so later calls are a single dict lookup
+        convert = next((_CONVERTERS[cls] for cls in type(o).__mro__ if cls in _CONVERTERS), None)
+        if convert is None:
+            raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+        _CONVERTERS[type(o)] = convert
+    return convert(o)
+
+# --- JSON Encoder ---
+# orjson is preferred; ujson is a slower but still C-implemented fallback for
+# environments without orjson wheels. Both return UTF-8 bytes.
+try:
+    import orjson
+
+    def json_dumps(obj):
+        """Serializes `obj` to JSON bytes with orjson."""
+        return orjson.dumps(obj, default=json_converter, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC)
+except ImportError:
+    import ujson
+
+    def json_dumps(obj):
+        """Serializes `obj` to JSON bytes with ujson."""
+        return ujson.dumps(obj, default=json_converter, ensure_ascii=False).encode('utf-8')
 
 # --- Snowflake Connection Logic ---
-def get_snowflake_connection():
-    """Establishes a connection to Snowflake using environment variables."""
-    try:
-        logging.info("Attempting to decode private key from environment variable...")
-        
-        private_key_b64 = os.environ.get('PRIVATE_KEY_STR')
-        if not private_key_b64:
-            raise ValueError("Environment variable PRIVATE_KEY_STR is not set.")
-            
-        private_key_bytes = base64.b64decode(private_key_b64)
-        logging.info("Private key successfully decoded from Base64.")
-
-        p_key = serialization.load_pem_private_key(
-            private_key_bytes,
-            password=None, 
-            backend=default_backend()
-        )
-        logging.info("Private key object successfully loaded.")
+# Idle connections are kept here and reused across requests, so the TLS
+# handshake and key-pair authentication are paid once per connection rather
+# than once per request.
+POOL_SIZE = int(os.environ.get('SNOWFLAKE_POOL_SIZE', 6))
+# Upper bound on connections checked out at once (idle ones don't count), and
+# how long a checkout waits for one to free up before failing.
+MAX_CONNECTIONS = int(os.environ.get('SNOWFLAKE_MAX_CONNECTIONS', 2 * POOL_SIZE))
+POOL_TIMEOUT = int(os.environ.get('SNOWFLAKE_POOL_TIMEOUT', 120))
+_connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+_connection_pool = queue.Queue(maxsize=POOL_SIZE)
 
-        pkb = p_key.private_bytes(
-            encoding=serialization.Encoding.DER,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-        logging.info("Private key converted to DER format for connection.")
-
-        # Using the exact environment variable names from your working file
-        conn_params = {
-            "user": os.environ.get('SNOWFLAKE_USERNAME'),
-            "account": os.environ.get('SNOWFLAKE_ACCOUNT'),
-            "warehouse": os.environ.get('SNOWFLAKE_WAREHOUSE'),
-            "database": os.environ.get('SNOWFLAKE_DATABASE'),
-            "schema": os.environ.get('SNOWFLAKE_SCHEMA'),
-            "role": os.environ.get('SNOWFLAKE_ROLE'),
-            "insecure_mode": True
-        }
-        
-        log_params = {k: v for k, v in conn_params.items()}
-        logging.info(f"Connecting to Snowflake with parameters: {log_params}")
-        
-        if not all([conn_params['user'], conn_params['account']]):
-            raise ValueError("SNOWFLAKE_USERNAME or SNOWFLAKE_ACCOUNT environment variable is empty.")
+@functools.lru_cache(maxsize=1)
+def load_private_key_der():
+    """Decodes PRIVATE_KEY_STR (Base64 PEM) into DER bytes once per process."""
+    logger.info("Attempting to decode private key from environment variable...")
+
+    private_key_b64 = os.environ.get('PRIVATE_KEY_STR')
+    if not private_key_b64:
+        raise ValueError("Environment variable PRIVATE_KEY_STR is not set.")
+
+    private_key_bytes = base64.b64decode(private_key_b64)
+    logger.debug("Private key successfully decoded from Base64.")
+
+    p_key = serialization.load_pem_private_key(
+        private_key_bytes,
+        password=None, 
+        backend=default_backend()
+    )
+    logger.debug("Private key object successfully loaded.")
 
+    pkb = p_key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    logger.info("Private key loaded and converted to DER format.")
+    return pkb
+
+@functools.lru_cache(maxsize=1)
+def snowflake_connection_params():
+    """Reads the connection settings from the environment once per process."""
+    # Using the exact environment variable names from your working file
+    conn_params = {
+        "user": os.environ.get('SNOWFLAKE_USERNAME'),
+        "account": os.environ.get('SNOWFLAKE_ACCOUNT'),
+        "warehouse": os.environ.get('SNOWFLAKE_WAREHOUSE'),
+        "database": os.environ.get('SNOWFLAKE_DATABASE'),
+        "schema": os.environ.get('SNOWFLAKE_SCHEMA'),
+        "role": os.environ.get('SNOWFLAKE_ROLE'),
+        "client_session_keep_alive": True,
+        "session_parameters": {
+            # Arrow result chunks are much smaller than JSON ones and feed
+            # fetch_arrow_batches() without any row conversion. Arrow is the
+            # Python connector's default; pinned because every read path here
+            # needs it (the connector ignores QUERY_RESULT_FORMAT).
+            "PYTHON_CONNECTOR_QUERY_RESULT_FORMAT": "ARROW",
+            # Cap result chunks at 48 MB (Snowflake's minimum; default 160).
+            # Smaller chunks mean more download requests, but with parallel
+            # queries and prefetching, at most prefetch threads x queries
+            # chunks are held in memory at once, which keeps peak RSS bounded.
+            "CLIENT_RESULT_CHUNK_SIZE": 48,
+            # The dashboard queries are constant, deterministic SQL, so
+            # repeats are answered from Snowflake's 24h result cache
+            "USE_CACHED_RESULT": True
+        },
+        "client_prefetch_threads": 4,
+        # Skips OCSP checks entirely. Only for local development behind
+        # networks that block the OCSP responders; never enable in production.
+        "insecure_mode": os.environ.get('SNOWFLAKE_INSECURE_MODE') == '1'
+    }
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Connecting to Snowflake with parameters: %s", conn_params)
+
+    if not all([conn_params['user'], conn_params['account']]):
+        raise ValueError("SNOWFLAKE_USERNAME or SNOWFLAKE_ACCOUNT environment variable is empty.")
+    return conn_params
+
+def open_snowflake_connection():
+    """Opens a new connection to Snowflake using environment variables."""
+    try:
         conn = snowflake.connector.connect(
-            **conn_params,
-            private_key=pkb,
+            **snowflake_connection_params(),
+            private_key=load_private_key_der(),
         )
-        logging.info("<<< SUCCESS! >>> Successfully connected to Snowflake!")
+        logger.debug("Successfully connected to Snowflake.")
         return conn
 
     except Exception as e:
-        logging.critical(f"An unexpected error occurred in get_snowflake_connection: {e}")
+        logger.critical("An unexpected error occurred in open_snowflake_connection: %s", e)
         raise
 
+def get_snowflake_connection(timeout=POOL_TIMEOUT):
+    """
+    Checks out an idle pooled connection, or opens a new one if none is
+    available. Every checkout must be paired with release_snowflake_connection().
+    """
+    if not _connection_slots.acquire(timeout=timeout):
+        raise RuntimeError(f"No Snowflake connection available after {timeout}s.")
+    try:
+        while True:
+            try:
+                conn = _connection_pool.get_nowait()
+            except queue.Empty:
+                return open_snowflake_connection()
+            if not conn.is_closed():
+                return conn
+    except Exception:
+        _connection_slots.release()
+        raise
+
+def release_snowflake_connection(conn):
+    """Returns a connection to the pool, closing it if the pool is already full."""
+    try:
+        if conn.is_closed():
+            return
+        try:
+            _connection_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            logger.debug("Snowflake connection closed.")
+    finally:
+        _connection_slots.release()
+
+# Decode the key at import so no request pays for the RSA parse (and workers
+# forked from a preloaded app inherit it). Problems are logged here and
+# raised again on the first connection attempt.
+if os.environ.get('PRIVATE_KEY_STR'):
+    try:
+        load_private_key_der()
+    except Exception as e:
+        logger.critical("Could not load private key at startup: %s", e)
+
 # --- Queries Definition ---
+def build_select(table, columns):
+    """
+    Builds a SELECT statement from (column, cast type) pairs. Columns with a
+    cast type are wrapped in TRY_CAST; columns with None are selected as-is.
+    Runs once at import, so the query text is a constant at request time.
+    """
+    select_list = ",\n            ".join(
+        f"TRY_CAST({column} AS {cast}) AS {column}" if cast else column
+        for column, cast in columns
+    )
+    return f"""
+        SELECT
+            {select_list}
+        FROM {table}
+    """
+
+# Only text and boolean columns are cast; numeric and timestamp columns are
+# returned with their native types.
+INVENTORY_PRODUCT_LEVEL_COLUMNS = [
+    ("ASIN", "VARCHAR"),
+    ("CARTS", "VARCHAR"),
+    ("COST", None),
+    ("COUNTRY", "VARCHAR"),
+    ("HEIGHT", None),
+    ("NAME", "VARCHAR"),
+    ("PRICE", None),
+    ("PRODUCT_ID", None),
+    ("SKU", "VARCHAR"),
+    ("TAGS", "VARCHAR"),
+    ("TOTAL_ALLOCATED", None),
+    ("TOTAL_AVAILABLE", None),
+    ("TOTAL_COMMITTED", None),
+    ("TOTAL_MFG_ORDERED", None),
+    ("TOTAL_ON_HAND", None),
+    ("TOTAL_UNALLOCATED", None),
+    ("TO_BE_SHIPPED", None),
+    ("UPC", "VARCHAR"),
+    ("UPDATED", None),
+    ("WEIGHT", None),
+    ("WIDTH", None),
+]
+
+INVENTORY_WAREHOUSE_LEVEL_COLUMNS = [
+    ("ALLOCATED", None),
+    ("AOH", None),
+    ("ASIN", "VARCHAR"),
+    ("CARTS", "VARCHAR"),
+    ("CMT", None),
+    ("COST", None),
+    ("COUNTRY", "VARCHAR"),
+    ("HEIGHT", None),
+    ("LOCATION", "VARCHAR"),
+    ("LOW_STOCK_THTD", None),
+    ("NAME", "VARCHAR"),
+    ("OMO", None),
+    ("ON_HAND", None),
+    ("OOS_THTD", None),
+    ("OPO", None),
+    ("POH", None),
+    ("PRICE", None),
+    ("PRODUCT_ID", None),
+    ("SKU", "VARCHAR"),
+    ("TAGS", "VARCHAR"),
+    ("TOTAL_ALLOCATED", None),
+    ("TOTAL_AVAILABLE", None),
+    ("TOTAL_COMMITTED", None),
+    ("TOTAL_MFG_ORDERED", None),
+    ("TOTAL_ON_HAND", None),
+    ("TOTAL_UNALLOCATED", None),
+    ("TO_BE_SHIPPED", None),
+    ("UNALLOCATED", None),
+    ("UPC", "VARCHAR"),
+    ("UPDATED", None),
+    ("WEIGHT", None),
+    ("WH_CREATED", None),
+    ("WH_ID", None),
+    ("WH_IS_DEFAULT", "BOOLEAN"),
+    ("WH_LAST_CHANGE", None),
+    ("WH_NAME", "VARCHAR"),
+    ("WH_SHIP_CFG", "BOOLEAN"),
+    ("WH_UPDATED", None),
+    ("WIDTH", None),
+]
+
 # 请用下面的整个字典替换您文件中的同名部分
 queries = {
     # 这些查询保持不变
@@ -110,120 +333,717 @@ queries = {
     # --- 最终修复 ---
     # 移除了所有数字和时间戳列的 CAST/TRY_CAST，只保留了对文本和布尔列的安全转换。
     # 这是解决所有数据库层面错误的最终版本。
-    "inventory_product_level_snap": """
-        SELECT
-            TRY_CAST(ASIN AS VARCHAR) AS ASIN,
-            TRY_CAST(CARTS AS VARCHAR) AS CARTS,
-            COST,
-            TRY_CAST(COUNTRY AS VARCHAR) AS COUNTRY,
-            HEIGHT,
-            TRY_CAST(NAME AS VARCHAR) AS NAME,
-            PRICE,
-            PRODUCT_ID,
-            TRY_CAST(SKU AS VARCHAR) AS SKU,
-            TRY_CAST(TAGS AS VARCHAR) AS TAGS,
-            TOTAL_ALLOCATED,
-            TOTAL_AVAILABLE,
-            TOTAL_COMMITTED,
-            TOTAL_MFG_ORDERED,
-            TOTAL_ON_HAND,
-            TOTAL_UNALLOCATED,
-            TO_BE_SHIPPED,
-            TRY_CAST(UPC AS VARCHAR) AS UPC,
-            UPDATED,
-            WEIGHT,
-            WIDTH
-        FROM SKU_PROFIT_PROJECT.ERD.INVENTORY_PRODUCT_LEVEL_SNAP
-    """,
+    "inventory_product_level_snap": build_select(
+        "SKU_PROFIT_PROJECT.ERD.INVENTORY_PRODUCT_LEVEL_SNAP", INVENTORY_PRODUCT_LEVEL_COLUMNS
+    ),
 
     # --- 最终修复 ---
     # 同样地，为仓库级别的库存数据应用了最终的健壮查询。
-    "inventory_warehouse_level_snap": """
-        SELECT
-            ALLOCATED,
-            AOH,
-            TRY_CAST(ASIN AS VARCHAR) AS ASIN,
-            TRY_CAST(CARTS AS VARCHAR) AS CARTS,
-            CMT,
-            COST,
-            TRY_CAST(COUNTRY AS VARCHAR) AS COUNTRY,
-            HEIGHT,
-            TRY_CAST(LOCATION AS VARCHAR) AS LOCATION,
-            LOW_STOCK_THTD,
-            TRY_CAST(NAME AS VARCHAR) AS NAME,
-            OMO,
-            ON_HAND,
-            OOS_THTD,
-            OPO,
-            POH,
-            PRICE,
-            PRODUCT_ID,
-            TRY_CAST(SKU AS VARCHAR) AS SKU,
-            TRY_CAST(TAGS AS VARCHAR) AS TAGS,
-            TOTAL_ALLOCATED,
-            TOTAL_AVAILABLE,
-            TOTAL_COMMITTED,
-            TOTAL_MFG_ORDERED,
-            TOTAL_ON_HAND,
-            TOTAL_UNALLOCATED,
-            TO_BE_SHIPPED,
-            UNALLOCATED,
-            TRY_CAST(UPC AS VARCHAR) AS UPC,
-            UPDATED,
-            WEIGHT,
-            WH_CREATED,
-            WH_ID,
-            TRY_CAST(WH_IS_DEFAULT AS BOOLEAN) AS WH_IS_DEFAULT,
-            WH_LAST_CHANGE,
-            TRY_CAST(WH_NAME AS VARCHAR) AS WH_NAME,
-            TRY_CAST(WH_SHIP_CFG AS BOOLEAN) AS WH_SHIP_CFG,
-            WH_UPDATED,
-            WIDTH
-        FROM SKU_PROFIT_PROJECT.ERD.INVENTORY_WAREHOUSE_LEVEL_SNAP
+    "inventory_warehouse_level_snap": build_select(
+        "SKU_PROFIT_PROJECT.ERD.INVENTORY_WAREHOUSE_LEVEL_SNAP", INVENTORY_WAREHOUSE_LEVEL_COLUMNS
+    )
+}
+
+# --- Optional polars Encoder ---
+# With USE_POLARS=1 (and polars installed), row-shaped batches are serialized
+# by polars straight from the Arrow buffers without creating Python objects
+# per cell.
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+USE_POLARS = pl is not None and os.environ.get('USE_POLARS') == '1'
+
+# --- Date Filter Pushdown ---
+# Date column of each time-series query. With ?since=YYYY-MM-DD, Snowflake
+# filters these tables so only the requested window is shipped and encoded.
+SINCE_COLUMNS = {
+    "orders": "date_time",
+    "refunds": "date_time",
+    "shipping": "ship_date",
+}
+
+def build_query(key, since=None):
+    """Returns the (sql, params) pair for a query, filtered to rows on or after `since` if given."""
+    query = queries[key]
+    column = SINCE_COLUMNS.get(key)
+    if since is None or column is None:
+        return query, None
+    return f"SELECT * FROM ({query}) WHERE {column} >= %(since)s", {"since": since}
+
+def parse_since():
+    """Parses the optional ?since=YYYY-MM-DD argument; raises ValueError if malformed."""
+    since = request.args.get('since')
+    return datetime.date.fromisoformat(since) if since else None
+
+# --- Batch Sizes ---
+# Rows per encoded batch. Snowflake picks its own result chunk size, which
+# for the wide inventory tables can be several MB; encoding smaller slices
+# keeps the batch being serialized small enough to stay in cache. ~8k rows
+# suits the narrow fact tables; the 20- and 40-column inventory snapshots use
+# proportionally fewer rows for a similar byte size per batch.
+DEFAULT_BATCH_ROWS = 8192
+BATCH_ROWS = {
+    "inventory_product_level_snap": 4096,
+    "inventory_warehouse_level_snap": 2048,
+}
+
+# --- Batch Encoders ---
+# Each encoder turns one Arrow batch of a table into one NDJSON line. `first`
+# is True for the first batch of each table. Clients pick one with ?format=.
+def format_timestamps(batch):
+    """
+    Converts every timestamp column of a batch to ISO 8601 strings in one
+    vectorized pass ("2024-01-01T12:00:00.000000+00:00", in UTC; naive
+    timestamps are taken as UTC), so the JSON encoder never calls back into
+    Python for them.
+    """
+    if not any(pa.types.is_timestamp(field.type) for field in batch.schema):
+        return batch
+    columns = []
+    for field, column in zip(batch.schema, batch.columns):
+        if pa.types.is_timestamp(field.type):
+            utc = 'UTC' if field.type.tz else None
+            column = pc.strftime(column.cast(pa.timestamp('us', tz=utc), safe=False), format='%Y-%m-%dT%H:%M:%S')
+            column = pc.binary_join_element_wise(column, '+00:00', '')
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+@functools.lru_cache(maxsize=None)
+def _records_prefix(key):
+    """Constant '{"type":<key>,"data":' prefix of a table's records lines."""
+    return b'{"type":' + json_dumps(key) + b',"data":'
+
+@functools.lru_cache(maxsize=None)
+def _section_line(key):
+    """'{"__section__":<key>}' line that starts each batch of the rows format."""
+    return json_dumps({"__section__": key}) + b'\n'
+
+def _polars_rows_json(batch):
+    """Encodes a batch as a JSON array of row objects with polars' Rust writer."""
+    table = pa.Table.from_batches([format_timestamps(batch)])
+    # polars writes decimals as strings; cast them to float like json_converter
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    # write_ndjson is row-oriented on every polars version (write_json is
+    # column-oriented before 1.0); join its lines into one array. Newlines
+    # inside strings are escaped, so splitting on them is safe.
+    lines = pl.from_arrow(table).write_ndjson().encode('utf-8').rstrip(b'\n')
+    return b'[' + lines.replace(b'\n', b',') + b']'
+
+def encode_records(key, batch, first):
+    """Row-shaped payload: {"type": key, "data": [{column: value, ...}, ...]}."""
+    # Only the row list goes through the encoder; the envelope is spliced in
+    # as bytes instead of building a wrapper dict per batch
+    if USE_POLARS:
+        rows = _polars_rows_json(batch)
+    else:
+        rows = json_dumps(format_timestamps(batch).to_pylist())
+    return _records_prefix(key) + rows + b'}\n'
+
+def encode_rows(key, batch, first):
+    """
+    One line per row, so clients can parse rows incrementally as lines arrive
+    instead of waiting for a whole batch. Each batch starts with a section
+    line {"__section__": key} and the {column: value} lines after it belong
+    to that table; the marker is repeated per batch because batches of
+    different tables interleave in the stream.
+    """
+    rows = format_timestamps(batch).to_pylist()
+    return _section_line(key) + b'\n'.join(map(json_dumps, rows)) + b'\n'
+
+def encode_columns(key, batch, first):
+    """
+    Tabular payload. The first batch of a table is preceded by a header line
+    {"type": key, "columns": [names]}; every batch is then sent as
+    {"type": key, "rows": [[values], ...]}. Column names are sent once per
+    table instead of once per row, which roughly halves the output for the
+    wide inventory tables.
+    """
+    header = json_dumps({"type": key, "columns": batch.schema.names}) + b'\n' if first else b''
+    batch = format_timestamps(batch)
+    payload = {
+        "type": key,
+        "rows": list(zip(*(column.to_pylist() for column in batch.columns)))
+    }
+    return header + json_dumps(payload) + b'\n'
+
+def encode_typed(key, batch, first):
+    """
+    Typed-array payload: {"type": key, "columns": [{"name", "dtype", "data"}, ...]}.
+    Integer, float and decimal columns without nulls are sent as base64 of
+    their little-endian values (decimals as float64), to be decoded with
+    JavaScript typed arrays (Float64Array, BigInt64Array, ...). Every other
+    column is sent as a plain JSON list with dtype "json".
     """
+    columns = []
+    batch = format_timestamps(batch)
+    for field, column in zip(batch.schema, batch.columns):
+        if pa.types.is_decimal(field.type):
+            column = column.cast(pa.float64())
+        if (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)) and column.null_count == 0:
+            values = column.to_numpy()
+            values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+            columns.append({
+                "name": field.name,
+                "dtype": str(values.dtype),
+                "data": base64.b64encode(values.tobytes()).decode('ascii')
+            })
+        else:
+            columns.append({"name": field.name, "dtype": "json", "data": column.to_pylist()})
+    return json_dumps({"type": key, "columns": columns}) + b'\n'
+
+def encode_arrow(key, batch, first):
+    """
+    Arrow IPC payload: {"type": key, "arrow": "<base64>"}. The first line of a
+    table carries the schema message followed by its record batches; later
+    lines carry record batches only, so concatenating the decoded payloads of
+    one table yields a valid Arrow IPC stream (e.g. for arrow-js).
+    """
+    data = batch.serialize().to_pybytes()
+    if first:
+        data = batch.schema.serialize().to_pybytes() + data
+    payload = {
+        "type": key,
+        "arrow": base64.b64encode(data).decode('ascii')
+    }
+    return json_dumps(payload) + b'\n'
+
+BATCH_ENCODERS = {
+    "records": encode_records,
+    "rows": encode_rows,
+    "columns": encode_columns,
+    "typed": encode_typed,
+    "arrow": encode_arrow,
+}
+
+# --- Encoding Process Pool ---
+# With ENCODE_PROCESSES > 0, batches are encoded in a separate process pool so
+# serializing large batches runs on other cores instead of contending for the
+# GIL with the request threads. Off by default: every batch is pickled (as
+# Arrow IPC) to a worker and the encoded bytes pickled back, which only pays
+# off on hosts with spare cores.
+ENCODE_PROCESSES = int(os.environ.get('ENCODE_PROCESSES', 0))
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+def get_encode_pool():
+    """Returns the shared encoding process pool, creating it on first use."""
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            # Created lazily so it is never inherited across a gunicorn fork;
+            # spawn avoids forking a process that already runs threads
+            _encode_pool = ProcessPoolExecutor(
+                max_workers=ENCODE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _encode_pool
+
+def encode_batch(encode, key, batch, first):
+    """Encodes one batch, in the process pool when ENCODE_PROCESSES is set."""
+    global _encode_pool
+    if not ENCODE_PROCESSES:
+        return encode(key, batch, first)
+    pool = get_encode_pool()
+    try:
+        return pool.submit(encode, key, batch, first).result()
+    except BrokenProcessPool as e:
+        # A dead worker (e.g. OOM-killed) breaks the pool for good; drop it so
+        # the next batch starts a fresh one, and encode this batch here
+        logger.warning("Encoding process pool broke, recreating it: %s", e)
+        with _encode_pool_lock:
+            if _encode_pool is pool:
+                _encode_pool = None
+        pool.shutdown(wait=False)
+        return encode(key, batch, first)
+
+# --- Result Cache ---
+# Encoded lines of each query are kept in memory per (table, format, filter)
+# and replayed without touching Snowflake for RESULT_CACHE_TTL seconds, since
+# the underlying tables change at most a few times a day (0 disables this).
+# Past the TTL, the inventory snapshots are still reused as long as a cheap
+# MAX(UPDATED) probe returns the same value, as they only change on refresh.
+# The cache is bounded: least recently used entries are evicted beyond
+# RESULT_CACHE_SIZE (two full dashboards by default), and results larger than
+# RESULT_CACHE_MAX_BYTES are streamed without being kept.
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 12))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+SNAPSHOT_VERSION_QUERIES = {
+    "inventory_product_level_snap": "SELECT MAX(UPDATED) FROM SKU_PROFIT_PROJECT.ERD.INVENTORY_PRODUCT_LEVEL_SNAP",
+    "inventory_warehouse_level_snap": "SELECT MAX(UPDATED) FROM SKU_PROFIT_PROJECT.ERD.INVENTORY_WAREHOUSE_LEVEL_SNAP",
 }
+_result_cache = collections.OrderedDict()
+_result_cache_lock = threading.Lock()
+
+def get_snapshot_version(cursor, key):
+    """Returns the current version of a snapshot table, or None if `key` is not a snapshot."""
+    version_query = SNAPSHOT_VERSION_QUERIES.get(key)
+    if version_query is None:
+        return None
+    cursor.execute(version_query)
+    return cursor.fetchone()[0]
+
+def result_cache_key(key, params, encode):
+    """Cache key of one query's encoded lines."""
+    return (key, encode.__name__, repr(params))
+
+def is_fresh_entry(entry, last_altered):
+    """True if a cache entry is within its TTL and was read under `last_altered`."""
+    return entry is not None and entry[0] > time.monotonic() and entry[3] == last_altered
+
+def is_fully_cached(encode, since, last_altered):
+    """
+    True if every query of a /api/data response is a fresh cache entry for
+    `last_altered`, i.e. the whole body replays a previously complete stream.
+    """
+    return all(
+        is_fresh_entry(get_cached_result(result_cache_key(key, build_query(key, since)[1], encode)), last_altered)
+        for key in queries
+    )
+
+def get_cached_result(cache_key):
+    """Returns the (expires_at, version, lines, last_altered) cache entry for `cache_key`, or None."""
+    with _result_cache_lock:
+        entry = _result_cache.get(cache_key)
+        if entry is not None:
+            _result_cache.move_to_end(cache_key)
+        return entry
+
+def store_cached_result(cache_key, version, lines, last_altered=None):
+    """
+    Caches the encoded lines of a fully streamed query, dropping expired
+    unversioned entries and evicting the least recently used ones.
+    `last_altered` is the source tables' state the lines were read under.
+    """
+    now = time.monotonic()
+    with _result_cache_lock:
+        expired = [k for k, (expires_at, v, _, _) in _result_cache.items() if v is None and expires_at <= now]
+        for k in expired:
+            del _result_cache[k]
+        _result_cache[cache_key] = (now + RESULT_CACHE_TTL, version, lines, last_altered)
+        _result_cache.move_to_end(cache_key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
 
 # --- Data Streaming Logic ---
-def stream_data():
-    """Generator function that connects to Snowflake and streams data in NDJSON format."""
+# Number of encoded batches the producer may run ahead of the client. While
+# the client is busy reading, the Snowflake download for the next batches
+# keeps going instead of sitting idle.
+QUEUE_DEPTH = 4
+# Target size of each chunk handed to the WSGI server
+WRITE_BUFFER_SIZE = 64 * 1024
+_END_OF_STREAM = object()
+
+def _put(out, item, stop):
+    """Blocks until `item` is queued; returns False once the client has gone away."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _put_all(out, lines, stop):
+    """Queues every line in order; returns False once the client has gone away."""
+    return all(_put(out, line, stop) for line in lines)
+
+def produce_query(key, query, params, encode, out, stop, last_altered=None):
+    """
+    Producer thread: runs one query on its own pooled connection and puts
+    encoded lines on `out`. Cached results are only served while they were
+    read under the same `last_altered` state, so they always match the ETag.
+    """
+    cache_key = result_cache_key(key, params, encode)
     conn = None
+    cursor = None
     try:
+        # Fresh cache hits never check out a connection
+        cached = get_cached_result(cache_key)
+        if is_fresh_entry(cached, last_altered):
+            logger.debug("Serving cached result for: %s", key)
+            _put_all(out, cached[2], stop)
+            return
+
         conn = get_snowflake_connection()
         cursor = conn.cursor()
+
+        version = get_snapshot_version(cursor, key)
+        if cached is not None and version is not None and cached[1] == version:
+            logger.debug("Serving cached snapshot for: %s", key)
+            store_cached_result(cache_key, version, cached[2], last_altered)
+            _put_all(out, cached[2], stop)
+            return
+
+        logger.debug("Executing query for: %s", key)
+        cursor.execute(query, params)
+        # Look the id up in the query history to confirm result cache reuse
+        logger.debug("Query id for %s: %s", key, cursor.sfqid)
         
-        for key, query in queries.items():
-            logging.info(f"Executing query for: {key}")
-            cursor.execute(query)
-            
-            for df_chunk in cursor.fetch_pandas_batches():
-                records = df_chunk.to_dict('records')
-                
-                payload = {
-                    "type": key,
-                    "data": records
-                }
-                
-                # Use the custom converter to handle Timestamp objects
-                yield json.dumps(payload, default=json_converter) + '\n'
-            logging.info(f"Finished streaming for: {key}")
+        # Arrow batches are encoded directly, skipping any pandas DataFrame.
+        # Snowflake's result chunks are re-sliced (zero-copy) to the table's
+        # batch size before encoding.
+        batch_rows = BATCH_ROWS.get(key, DEFAULT_BATCH_ROWS)
+        cacheable = RESULT_CACHE_TTL > 0 or version is not None
+        first = True
+        lines = []
+        size = 0
+        for table in cursor.fetch_arrow_batches():
+            for batch in table.to_batches(max_chunksize=batch_rows):
+                line = encode_batch(encode, key, batch, first)
+                first = False
+                if cacheable:
+                    size += len(line)
+                    if size <= RESULT_CACHE_MAX_BYTES:
+                        lines.append(line)
+                    else:
+                        # Too large to keep; stop holding on to the lines
+                        cacheable = False
+                        lines = None
+                if not _put(out, line, stop):
+                    return
+        if cacheable:
+            store_cached_result(cache_key, version, lines, last_altered)
+        logger.debug("Finished streaming for: %s", key)
 
     except Exception as e:
-        logging.error(f"!!! ERROR !!! An error occurred during streaming: {e}")
+        logger.error("!!! ERROR !!! An error occurred during streaming %s: %s", key, e)
         error_payload = {
             "type": "error",
             "message": str(e)
         }
-        yield json.dumps(error_payload) + '\n'
+        _put(out, json_dumps(error_payload) + b'\n', stop)
     finally:
-        if conn and not conn.is_closed():
-            conn.close()
-            logging.info("Snowflake connection closed.")
+        if cursor:
+            cursor.close()
+        if conn:
+            release_snowflake_connection(conn)
+        _put(out, _END_OF_STREAM, stop)
+
+def stream_data(encode=encode_records, since=None, last_altered=None):
+    """
+    Generator function that runs all queries in parallel and streams their
+    NDJSON lines to the client as they arrive. Batches of different tables
+    are interleaved; each line carries its table in "type".
+    """
+    out = queue.Queue(maxsize=QUEUE_DEPTH)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    for key in queries:
+        query, params = build_query(key, since)
+        executor.submit(produce_query, key, query, params, encode, out, stop, last_altered)
+    # Submitted jobs keep running; this only stops accepting new ones
+    executor.shutdown(wait=False)
+
+    pending = len(queries)
+    buffer = bytearray()
+    try:
+        while pending:
+            line = out.get()
+            if line is _END_OF_STREAM:
+                pending -= 1
+                continue
+            buffer += line
+            # Coalesce small lines into ~64 KB writes, but don't hold data back
+            # while the producers have nothing else ready
+            if len(buffer) >= WRITE_BUFFER_SIZE or out.empty():
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+    finally:
+        # Also reached when the client disconnects mid-stream
+        stop.set()
+
+def execute_arrow_query(key, since=None):
+    """
+    Runs one query on a pooled connection and returns (conn, cursor), so
+    connection and SQL errors surface before any response headers are sent.
+    """
+    conn = get_snowflake_connection()
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        logger.debug("Executing Arrow query for: %s", key)
+        cursor.execute(*build_query(key, since))
+        return conn, cursor
+    except Exception:
+        if cursor:
+            cursor.close()
+        release_snowflake_connection(conn)
+        raise
+
+def stream_arrow(key, cursor):
+    """
+    Generator function that streams an executed query's result as a raw
+    Arrow IPC stream, for clients that decode Arrow natively (e.g. arrow-js).
+    """
+    try:
+        tables = iter(cursor.fetch_arrow_batches())
+        first = next(tables, None)
+        if first is None:
+            # Empty result: still send the schema so the stream is valid
+            first = cursor.fetch_arrow_all(force_return_table=True)
+
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, first.schema)
+        for table in itertools.chain([first], tables):
+            writer.write_table(table, max_chunksize=BATCH_ROWS.get(key, DEFAULT_BATCH_ROWS))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
+        logger.debug("Finished Arrow streaming for: %s", key)
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated stream
+        logger.error("!!! ERROR !!! An error occurred during Arrow streaming %s: %s", key, e)
+
+# --- Stage Export ---
+# For large tables it is much faster to let Snowflake write Parquet to a stage
+# in parallel and hand the client a presigned URL than to pull every row
+# through this process. Opt-in: set SNOWFLAKE_EXPORT_STAGE to a stage name.
+EXPORT_STAGE = os.environ.get('SNOWFLAKE_EXPORT_STAGE')
+EXPORT_URL_EXPIRY = int(os.environ.get('SNOWFLAKE_EXPORT_URL_EXPIRY', 3600))
+_export_stage_ready = threading.Event()
+
+def ensure_export_stage(cursor):
+    """Creates the export stage on first use."""
+    if not _export_stage_ready.is_set():
+        # Presigned URLs require server-side encryption on internal stages
+        cursor.execute(
+            f"CREATE STAGE IF NOT EXISTS {EXPORT_STAGE} "
+            "FILE_FORMAT = (TYPE = PARQUET) ENCRYPTION = (TYPE = 'SNOWFLAKE_SSE')"
+        )
+        _export_stage_ready.set()
+
+def export_to_stage(key, since=None):
+    """
+    Unloads one query into a single Parquet file on the export stage and
+    returns a presigned URL for it.
+    """
+    query, params = build_query(key, since)
+    path = f"{key}_{time.time_ns()}.parquet"
+    conn = get_snowflake_connection()
+    try:
+        with conn.cursor() as cursor:
+            ensure_export_stage(cursor)
+            cursor.execute(
+                f"COPY INTO @{EXPORT_STAGE}/{path} FROM ({query}) "
+                "FILE_FORMAT = (TYPE = PARQUET) HEADER = TRUE SINGLE = TRUE OVERWRITE = TRUE "
+                "MAX_FILE_SIZE = 5368709120",
+                params,
+            )
+            cursor.execute(
+                f"SELECT GET_PRESIGNED_URL(@{EXPORT_STAGE}, %(path)s, %(expiry)s)",
+                {"path": path, "expiry": EXPORT_URL_EXPIRY},
+            )
+            return cursor.fetchone()[0]
+    finally:
+        release_snowflake_connection(conn)
+
+# --- HTTP Caching ---
+# One metadata query tells whether any source table changed, so unchanged
+# dashboards get a 304 without any rows being fetched or encoded.
+LAST_ALTERED_QUERY = """
+    SELECT MAX(LAST_ALTERED)
+    FROM SKU_PROFIT_PROJECT.INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = 'ERD'
+      AND TABLE_NAME IN (
+          'MASTER_COST_FACT', 'AMAZON_NEW_ORDER_FACT', 'AMAZON_NEW_REFUND_FACT', 'NEW_SHIPPING',
+          'INVENTORY_PRODUCT_LEVEL_SNAP', 'INVENTORY_WAREHOUSE_LEVEL_SNAP'
+      )
+"""
+
+# The probe result is reused for a short while so cached responses don't need
+# Snowflake at all, and it never waits long for a busy pool.
+LAST_ALTERED_TTL = int(os.environ.get('LAST_ALTERED_TTL', 30))
+LAST_ALTERED_POOL_TIMEOUT = 1
+_last_altered = (0.0, None)
+
+def get_last_altered():
+    """
+    Returns MAX(LAST_ALTERED) of the source tables, probed at most every
+    LAST_ALTERED_TTL seconds, or None if it can't be determined.
+    """
+    global _last_altered
+    expires_at, last_altered = _last_altered
+    if expires_at > time.monotonic():
+        return last_altered
+    conn = None
+    try:
+        conn = get_snowflake_connection(timeout=LAST_ALTERED_POOL_TIMEOUT)
+        with conn.cursor() as cursor:
+            cursor.execute(LAST_ALTERED_QUERY)
+            last_altered = cursor.fetchone()[0]
+    except Exception as e:
+        logger.warning("Could not probe source tables: %s", e)
+        return None
+    finally:
+        if conn:
+            release_snowflake_connection(conn)
+    _last_altered = (time.monotonic() + LAST_ALTERED_TTL, last_altered)
+    return last_altered
+
+def data_etag(last_altered, *variant):
+    """
+    Returns an ETag for the `last_altered` state of the source tables combined
+    with the request `variant` (format, filter, ...), or None if it is unknown.
+    """
+    if last_altered is None:
+        return None
+    return hashlib.blake2b(repr((last_altered, *variant)).encode('utf-8'), digest_size=16).hexdigest()
+
+# --- Response Compression ---
+# Low levels keep compression cheap; repetitive NDJSON still shrinks ~8-10x.
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 1))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 1))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def gzip_stream(chunks):
+    """Gzip-compresses a byte stream chunk by chunk without buffering the whole response."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            # Sync-flush per batch so the client can decode each line as it arrives
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        chunks.close()
+
+def zstd_stream(chunks):
+    """Zstandard-compresses a byte stream chunk by chunk without buffering the whole response."""
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    try:
+        for chunk in chunks:
+            # Flush a complete block per batch, like the gzip sync-flush
+            yield compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+    finally:
+        chunks.close()
+
+def brotli_stream(chunks):
+    """Brotli-compresses a byte stream chunk by chunk without buffering the whole response."""
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    try:
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    finally:
+        chunks.close()
+
+# Content encodings in order of preference; zstd and br only if their packages are installed
+STREAM_COMPRESSORS = {"gzip": gzip_stream}
+if brotli is not None:
+    STREAM_COMPRESSORS = {"br": brotli_stream, **STREAM_COMPRESSORS}
+if zstandard is not None:
+    STREAM_COMPRESSORS = {"zstd": zstd_stream, **STREAM_COMPRESSORS}
+
+def streaming_response(chunks, mimetype, on_close=None):
+    """
+    Wraps a byte generator in a Response, compressed with the best encoding
+    the client accepts. `on_close` runs when the server closes the response,
+    even if the stream was never started.
+    """
+    encoding = next((name for name in STREAM_COMPRESSORS if name in request.accept_encodings), None)
+    if encoding:
+        chunks = STREAM_COMPRESSORS[encoding](chunks)
+    if on_close:
+        # direct_passthrough hands this iterable to the server as-is, which
+        # skips Response.call_on_close callbacks
+        chunks = ClosingIterator(chunks, on_close)
+
+    # The chunks are already bytes, so let Werkzeug pass them through as-is
+    response = Response(chunks, mimetype=mimetype, direct_passthrough=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 # --- API Endpoint ---
 @app.route('/api/data')
 def api_data():
     """API endpoint that returns the streaming data response."""
-    return Response(stream_data(), mimetype='application/x-ndjson')
+    encode = BATCH_ENCODERS.get(request.args.get('format', 'records'))
+    if encode is None:
+        return {"error": f"Unknown format, expected one of: {', '.join(BATCH_ENCODERS)}"}, 400
+    try:
+        since = parse_since()
+    except ValueError:
+        return {"error": "Invalid since, expected YYYY-MM-DD"}, 400
+
+    # Weak ETag: the same data may be sent with different content encodings
+    last_altered = get_last_altered()
+    etag = data_etag(last_altered, encode.__name__, since)
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        # Errors are reported inside the 200 body, so only a body replayed
+        # entirely from complete cached streams may be revalidated later
+        if etag and not is_fully_cached(encode, since, last_altered):
+            etag = None
+        # The body is built from the same state the ETag describes
+        response = streaming_response(stream_data(encode, since, last_altered), 'application/x-ndjson')
+    if etag:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, max-age=60'
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/data.arrow')
+def api_data_arrow():
+    """API endpoint that streams one table (?type=<query key>) as Arrow IPC."""
+    key = request.args.get('type')
+    if key not in queries:
+        return {"error": f"Unknown type, expected one of: {', '.join(queries)}"}, 400
+    try:
+        since = parse_since()
+    except ValueError:
+        return {"error": "Invalid since, expected YYYY-MM-DD"}, 400
+    try:
+        conn, cursor = execute_arrow_query(key, since)
+    except Exception as e:
+        logger.error("!!! ERROR !!! An error occurred during Arrow query %s: %s", key, e)
+        return {"error": str(e)}, 500
+
+    def close():
+        cursor.close()
+        release_snowflake_connection(conn)
+
+    return streaming_response(stream_arrow(key, cursor), 'application/vnd.apache.arrow.stream', on_close=close)
+
+@app.route('/api/export')
+def api_export():
+    """API endpoint that exports one table (?type=<query key>) to Parquet and returns its URL."""
+    if not EXPORT_STAGE:
+        return {"error": "Export is not enabled"}, 404
+    key = request.args.get('type')
+    if key not in queries:
+        return {"error": f"Unknown type, expected one of: {', '.join(queries)}"}, 400
+    try:
+        since = parse_since()
+    except ValueError:
+        return {"error": "Invalid since, expected YYYY-MM-DD"}, 400
+    try:
+        url = export_to_stage(key, since)
+    except Exception as e:
+        logger.error("Error exporting %s: %s", key, e)
+        return {"error": str(e)}, 500
+    return {f"{key}_url": url, "expires_in": EXPORT_URL_EXPIRY}
 
 @app.route('/')
 def index():
@@ -231,5 +1051,7 @@ def index():
     return "Proxy server is running. Access data at /api/data"
 
 # --- Main Execution ---
+# Local development only; production runs under gunicorn:
+#   gunicorn -c gunicorn.conf.py app:app
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)), threaded=True)
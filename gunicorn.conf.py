@@ -0,0 +1,48 @@
+#
+# gunicorn.conf.py
+#
+# Usage: gunicorn -c gunicorn.conf.py app:app
+#        gunicorn -c gunicorn.conf.py proxy_server:app
+#
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# gevent must patch the standard library before the app (and with it the
+# Snowflake connector, requests and ssl) is preloaded in the master
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# --- Binding ---
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# --- Workers ---
+# A /api/data stream occupies its worker for as long as Snowflake keeps
+# sending batches. Threaded workers let each process serve several streams
+# concurrently (the connector releases the GIL while waiting on the network)
+# instead of blocking a whole sync worker per client.
+# GUNICORN_WORKER_CLASS=gevent (requires the gevent package) serves many
+# concurrent streams per worker from cooperative greenlets instead.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Concurrent clients per gevent worker. Only set for gevent: gthread also
+# uses it to cap open (keep-alive) connections, where gunicorn's default
+# of 1000 should stay.
+if worker_class == 'gevent':
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Worker heartbeat files on tmpfs, so a slow disk can't stall the workers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Streaming the inventory snapshots can take minutes on a cold warehouse
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+# Dashboards poll the API; keep their HTTP connections open between requests
+keepalive = 30
+
+# --- Preloading ---
+# Import the app once in the master before forking, so the private key is
+# decoded a single time and shared copy-on-write by all workers. Connection
+# pools, executors and caches are created lazily, so nothing socket- or
+# thread-bound is inherited across the fork.
+preload_app = True
@@ -1,16 +1,31 @@
 import os
 import base64
+import datetime
+import decimal
+import functools
+import hashlib
 import logging
-from flask import Flask, request, jsonify
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+import orjson
+from flask import Flask, Response, request
 from flask_cors import CORS
-import snowflake.connector
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+from werkzeug.exceptions import RequestEntityTooLarge
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("proxy")
+# 连接器自己的 INFO 日志很多（每次查询、每个结果分块都会打），只保留警告以上
+logging.getLogger("snowflake.connector").setLevel(logging.WARNING)
 
 app = Flask(__name__)
+# 请求体上限：超大的 SQL 直接 413，不读进内存
+MAX_REQUEST_BYTES = 64 * 1024
+# 多留 1 字节：新版 Werkzeug 对没有 Content-Length 的 body 只是截断到上限、不报错，
+# 读到超过 MAX_REQUEST_BYTES 的数据就说明请求超限
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES + 1
 
 # ===== CORS（可选：限定来源域名）=====
 allowed_origin = os.getenv("ALLOWED_ORIGIN")  # e.g. https://your-dashboard.example
@@ -20,22 +35,56 @@ else:
     CORS(app)  # 宽松（开发期）
 
 # ---------- helpers ----------
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+def _json_default(o):
+    """orjson 无法原生处理的类型：Decimal 按 jsonify 的习惯转为字符串，datetime 子类转 ISO 8601"""
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, datetime.datetime):
+        # Arrow 路径上纳秒精度的时间戳是 pd.Timestamp；还原成普通 datetime 交回 orjson，
+        # 这样无时区的值同样按 OPT_NAIVE_UTC 输出 "+00:00"，和其他精度、fetchmany 路径一致
+        return datetime.datetime(*o.timetuple()[:6], o.microsecond, o.tzinfo)
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+def _json_response(obj, status=200):
+    """用 orjson 直接序列化为 bytes（替代 jsonify 的标准库 json）"""
+    return Response(
+        orjson.dumps(obj, default=_json_default, option=_ORJSON_OPTIONS),
+        status=status,
+        mimetype="application/json",
+    )
+
+_sf = None
+
+def _snowflake():
+    """
+    snowflake.connector 导入很重（pyarrow、pyOpenSSL 等，几百 ms），第一次连接时才导入，
+    /healthz 和冷启动不用为它付出代价
+    """
+    global _sf
+    if _sf is None:
+        import snowflake.connector
+        _sf = snowflake.connector
+    return _sf
+
 def _load_private_key_from_env() -> bytes:
     """从 PRIVATE_KEY_STR 读私钥（支持 base64 或原始 PEM），返回 DER(PKCS8)"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.backends import default_backend
+
     key_str = os.environ.get("PRIVATE_KEY_STR")
     if not key_str:
         raise ValueError("ENV PRIVATE_KEY_STR is missing")
 
     raw: bytes
-    # 先尝试 base64
-    try:
-        raw = base64.b64decode(key_str)
-        if b"-----BEGIN" in raw:
-            # 传的是 base64 后仍带 PEM 头，等同普通 PEM
-            pass
-    except Exception:
-        # 不是 base64，就当原始 PEM
+    # 按开头判断格式：原始 PEM 以 -----BEGIN 开头，否则当作 base64 编码后的 PEM
+    if key_str.lstrip().startswith("-----BEGIN"):
         raw = key_str.encode("utf-8")
+    else:
+        raw = base64.b64decode(key_str)
 
     passphrase = os.environ.get("PRIVATE_KEY_PASSPHRASE")
     password_bytes = passphrase.encode() if passphrase else None
@@ -50,46 +99,57 @@ def _load_private_key_from_env() -> bytes:
     )
     return der
 
-def get_snowflake_connection():
-    # 关键参数
-    account  = os.getenv("SNOWFLAKE_ACCOUNT")     # e.g. RRCWSFA-BSB89302
-    host     = os.getenv("SNOWFLAKE_HOST")        # e.g. RRCWSFA-BSB89302.snowflakecomputing.com (可选)
-    user     = os.getenv("SNOWFLAKE_USER")
-    role     = os.getenv("SNOWFLAKE_ROLE")        # e.g. DASHBOARD_READONLY
-    warehouse= os.getenv("SNOWFLAKE_WAREHOUSE")
-    database = os.getenv("SNOWFLAKE_DATABASE")
-    schema   = os.getenv("SNOWFLAKE_SCHEMA")
-
-    if not all([account, user, warehouse, database, schema]):
+# 关键参数：进程启动时读取一次，请求路径上不再读环境变量
+_SF_CONFIG = {
+    "account":   os.getenv("SNOWFLAKE_ACCOUNT"),     # e.g. RRCWSFA-BSB89302
+    "host":      os.getenv("SNOWFLAKE_HOST"),        # e.g. RRCWSFA-BSB89302.snowflakecomputing.com (可选)
+    "user":      os.getenv("SNOWFLAKE_USER"),
+    "role":      os.getenv("SNOWFLAKE_ROLE"),        # e.g. DASHBOARD_READONLY
+    "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
+    "database":  os.getenv("SNOWFLAKE_DATABASE"),
+    "schema":    os.getenv("SNOWFLAKE_SCHEMA"),
+}
+
+# 私钥解析（RSA/PEM → DER）很耗 CPU，启动时做一次；失败则留到连接时再报错
+_PKB_DER = None
+if os.getenv("PRIVATE_KEY_STR"):
+    try:
+        _PKB_DER = _load_private_key_from_env()
+    except Exception as e:
+        log.error("Failed to load private key at startup: %s", e)
+
+@functools.lru_cache(maxsize=1)
+def _sf_kwargs():
+    """connect() 的参数（私钥除外）只拼一次；缺少必填项时抛错且不缓存"""
+    if not all(_SF_CONFIG[k] for k in ("account", "user", "warehouse", "database", "schema")):
         raise ValueError("Missing one of required envs: SNOWFLAKE_ACCOUNT/USER/WAREHOUSE/DATABASE/SCHEMA")
+    return {
+        **_SF_CONFIG,  # host 可为 None
+        "login_timeout": 20,
+        "network_timeout": 20,
+        "client_session_keep_alive": True,
+        "application": "RenderProxy/1.0",
+        # Arrow 路径下 NUMBER(p,s) 默认会被转成 float64；保持 Decimal，输出仍是 "1.10" 这样的字符串
+        "arrow_number_to_decimal": True,
+        # ? 占位符走服务端绑定：SQL 文本不随参数变化，Snowflake 结果缓存更容易命中
+        "paramstyle": "qmark",
+    }
 
-    pkb = _load_private_key_from_env()
+def get_snowflake_connection():
+    kwargs = _sf_kwargs()
+    pkb = _PKB_DER or _load_private_key_from_env()
 
     try:
-        log.info(
-            "Connecting to Snowflake | account=%s host=%s user=%s role=%s wh=%s db=%s schema=%s",
-            account, host or "(default)", user, role or "(default)", warehouse, database, schema
-        )
-        conn = snowflake.connector.connect(
-            account=account,
-            host=host,  # 可为 None
-            user=user,
-            private_key=pkb,
-            role=role,
-            warehouse=warehouse,
-            database=database,
-            schema=schema,
-            login_timeout=20,
-            network_timeout=20,
-            client_session_keep_alive=True,
-            application="RenderProxy/1.0",
-        )
-        # 快速验证一下连通性
-        with conn.cursor() as cur:
-            cur.execute("SELECT CURRENT_ACCOUNT(), CURRENT_REGION(), CURRENT_ROLE()")
-            cur.fetchone()
+        # 有连接池后只在新建连接时走到这里
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                "Connecting to Snowflake | account=%s host=%s user=%s role=%s wh=%s db=%s schema=%s",
+                kwargs["account"], kwargs["host"] or "(default)", kwargs["user"], kwargs["role"] or "(default)",
+                kwargs["warehouse"], kwargs["database"], kwargs["schema"]
+            )
+        conn = _snowflake().connect(**kwargs, private_key=pkb)
         return conn
-    except snowflake.connector.errors.Error as e:
+    except _snowflake().errors.Error as e:
         log.error("Snowflake error: number=%s code=%s state=%s msg=%s",
                   getattr(e, 'errno', None), getattr(e, 'sqlstate', None), getattr(e, 'sfqid', None), str(e))
         raise
@@ -97,38 +157,302 @@ def get_snowflake_connection():
         log.error("Failed to connect to Snowflake: %s", e)
         raise
 
+# ---------- connection pool ----------
+POOL_SIZE = int(os.getenv("SNOWFLAKE_POOL_SIZE", "8"))
+# 连接全部在用时只等很短时间，随后返回 503 让客户端重试，而不是让请求在 worker 里排长队
+POOL_TIMEOUT = float(os.getenv("SNOWFLAKE_POOL_TIMEOUT", "1"))
+# 单条查询在 Snowflake 端的超时（秒），超时由服务端取消
+QUERY_TIMEOUT = int(os.getenv("SNOWFLAKE_QUERY_TIMEOUT", "25"))
+# 空闲超过这个时间（秒）的连接，取出时先用 SELECT 1 确认还能用
+IDLE_PING_SECONDS = 300
+
+class PoolExhausted(Exception):
+    """连接池已满且等待超时"""
+
+class SnowflakeConnectionPool:
+    """固定上限的连接池：最多 size 个连接同时在用，用完放回复用，省掉每个请求的握手/认证"""
+
+    def __init__(self, size, timeout):
+        # LIFO：最近用过的连接最可能还活着；元素为 (conn, 上次归还时间)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._timeout = timeout
+
+    def get(self):
+        """取一个空闲连接，没有就新建；连接数已满时最多等 timeout 秒"""
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolExhausted("No Snowflake connection available")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return get_snowflake_connection()
+                # 已失效的连接直接丢弃；存活的会话由 client_session_keep_alive 保活
+                if conn.is_closed():
+                    continue
+                if time.monotonic() - last_used > IDLE_PING_SECONDS and not self._ping(conn):
+                    continue
+                return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    @staticmethod
+    def _ping(conn):
+        """长时间空闲的连接先探活，失败则关闭丢弃"""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception as e:
+            log.warning("Dropping stale Snowflake connection: %s", e)
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return False
+
+    def put(self, conn):
+        """归还连接（已关闭的不再放回）"""
+        try:
+            if not conn.is_closed():
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """首次请求时才创建连接池（gunicorn fork 之后，各 worker 各自一份）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SnowflakeConnectionPool(POOL_SIZE, POOL_TIMEOUT)
+    return _pool
+
+# ---------- result cache ----------
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+# 超过这个大小的结果只流式返回、不缓存，避免大查询撑爆内存
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# 整个缓存（每个 worker）的总字节上限，超出时按 LRU 淘汰；SQL 由客户端决定，不能只限条数
+RESULT_CACHE_MAX_TOTAL_BYTES = int(os.getenv("RESULT_CACHE_MAX_TOTAL_BYTES", str(64 * 1024 * 1024)))
+
+class ResultCache:
+    """LRU + TTL 缓存：SQL → 已序列化的 JSON bytes；同一条 SQL 同一时间只查询一次"""
+
+    def __init__(self, size, ttl, max_bytes):
+        self._entries = OrderedDict()   # key -> (过期时间, body)
+        self._pending = {}              # key -> 正在查询的请求持有的 Event
+        self._lock = threading.Lock()
+        self._size = size
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._bytes = 0                 # 当前缓存的 body 总字节数
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def lookup(self, key):
+        """
+        返回 (body, event, owner)：命中时 body 不为 None；owner 为 True 时由调用方执行查询，
+        结束后必须调用 release；否则同样的查询正在执行，调用方可以等 event 再读缓存
+        """
+        with self._lock:
+            body = self._get(key)
+            if body is not None:
+                return body, None, False
+            event = self._pending.get(key)
+            if event is not None:
+                return None, event, False
+            event = self._pending[key] = threading.Event()
+            return None, event, True
+
+    def release(self, key, event, body=None):
+        """结束一次查询：body 不为 None 时写入缓存，并唤醒等待的请求（可重复调用）"""
+        with self._lock:
+            if body is not None and len(body) <= self._max_bytes:
+                self._discard(key)
+                self._entries[key] = (time.monotonic() + self._ttl, body)
+                self._bytes += len(body)
+                while len(self._entries) > self._size or self._bytes > self._max_bytes:
+                    self._discard(next(iter(self._entries)))
+            if self._pending.get(key) is event:
+                del self._pending[key]
+        event.set()
+
+_result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_MAX_TOTAL_BYTES)
+
+def _cache_key(sql, params=None):
+    # 按原始 SQL + 绑定参数区分（不做大小写/空白归一化，否则会混淆字符串字面量）
+    h = hashlib.blake2b(sql.encode("utf-8"), digest_size=16)
+    if params:
+        h.update(b"\0" + orjson.dumps(params))
+    return h.digest()
+
+FETCH_BATCH_ROWS = 10000
+
+def _row_batches(cur):
+    """
+    按批产出行 dict 列表。优先走 Arrow：整批在 C 里按列解码，不经过连接器逐行转换
+    Python 对象；结果不是 Arrow 格式时退回 fetchmany
+    """
+    try:
+        tables = cur.fetch_arrow_batches()
+    except _snowflake().errors.NotSupportedError:
+        cols = [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(FETCH_BATCH_ROWS)
+            if not rows:
+                return
+            yield [dict(zip(cols, r)) for r in rows]
+    for table in tables:
+        # 连接器给出的批大小取决于结果分块，这里再切成固定大小控制峰值内存
+        for batch in table.to_batches(max_chunksize=FETCH_BATCH_ROWS):
+            yield batch.to_pylist()
+
+def _stream_rows(cur, on_complete=None):
+    """
+    逐批输出 JSON 数组片段，峰值内存约为一批数据而不是整个结果集。
+    完整输出且不超过 RESULT_CACHE_MAX_BYTES 时，把整个 body 交给 on_complete
+    """
+    try:
+        parts = [] if on_complete else None
+        size = 0
+        yield b"["
+        sep = b""
+        for rows in _row_batches(cur):
+            if not rows:
+                continue
+            # 去掉每批数组的 [ ]，拼接成一个完整数组
+            chunk = sep + orjson.dumps(rows, default=_json_default, option=_ORJSON_OPTIONS)[1:-1]
+            if parts is not None:
+                size += len(chunk)
+                if size <= RESULT_CACHE_MAX_BYTES:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+            sep = b","
+        yield b"]"
+        if parts is not None:
+            on_complete(b"[" + b"".join(parts) + b"]")
+    except Exception as e:
+        # 响应头已发出，只能记录日志（客户端会收到截断的 JSON）
+        log.error("Streaming failed: %s", e)
+
+# 简单保护：只允许 SELECT 或 CTE（WITH ... SELECT）开头的语句
+_SELECT_RE = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+
 # ---------- routes ----------
+_HEALTHZ_BODY = orjson.dumps({"ok": True})
+
 @app.route("/healthz", methods=["GET"])
 def healthz():
-    return jsonify({"ok": True})
+    # body 预先序列化；Response 每次新建，因为 CORS 等会改写响应头，共享对象会串改
+    return Response(_HEALTHZ_BODY, mimetype="application/json")
 
 @app.route("/api/query", methods=["POST"])
 def api_query():
     try:
-        data = request.get_json(silent=True) or {}
-        sql = (data.get("sql") or "").strip()
+        if request.content_length and request.content_length > MAX_REQUEST_BYTES:
+            return _json_response({"error": "SQL too large"}, 413)
+
+        # 显式读取 body：没有 Content-Length（chunked）的超大请求在这里才能发现，
+        # get_json(silent=True) 会把超限当成空 body
+        try:
+            body = request.get_data(cache=False) if request.is_json else b""
+        except RequestEntityTooLarge:
+            body = None
+        if body is None or len(body) > MAX_REQUEST_BYTES:
+            return _json_response({"error": "SQL too large"}, 413)
+        # 空 body / 非法 JSON 时 data 为 None，不再额外构造空 dict
+        try:
+            data = orjson.loads(body) if body else None
+        except orjson.JSONDecodeError:
+            data = None
+        sql = (data.get("sql") if isinstance(data, dict) else None) or ""
+        # 可选的绑定参数：{"sql": "... WHERE d >= ?", "params": ["2024-01-01"]}
+        params = data.get("params") if isinstance(data, dict) else None
+        if params is not None and not isinstance(params, list):
+            return _json_response({"error": "params must be a list"}, 400)
+        # 只有首尾确实有空白时才 strip，避免复制整条 SQL
+        if sql and (sql[0].isspace() or sql[-1].isspace()):
+            sql = sql.strip()
 
         if not sql:
-            return jsonify({"error": "SQL is missing"}), 400
+            return _json_response({"error": "SQL is missing"}, 400)
+
+        # 简单保护（你也可以移除）
+        if not _SELECT_RE.match(sql):
+            return _json_response({"error": "Only SELECT statements are allowed"}, 400)
 
-        # 简单保护：只允许 SELECT（你也可以移除）
-        if not sql[:6].upper() == "SELECT":
-            return jsonify({"error": "Only SELECT statements are allowed"}), 400
+        # 先查缓存；同样的查询正在执行时等它完成，避免冷缓存时的并发重复查询
+        key = _cache_key(sql, params)
+        body, event, owner = _result_cache.lookup(key)
+        if event is not None and not owner:
+            event.wait(QUERY_TIMEOUT)
+            body = _result_cache.get(key)
+        if body is not None:
+            return Response(body, mimetype="application/json")
 
-        conn = get_snowflake_connection()
         try:
-            with conn.cursor(snowflake.connector.DictCursor) as cur:
-                cur.execute(sql)
-                rows = cur.fetchall()
-            return jsonify(rows)
-        finally:
-            conn.close()
-    except snowflake.connector.errors.Error as e:
+            conn = _get_pool().get()
+        except Exception:
+            if owner:
+                _result_cache.release(key, event)
+            raise
+        try:
+            # 默认 tuple cursor，比 DictCursor 逐行建 dict 更快
+            cur = conn.cursor()
+            cur.execute(sql, params or None, timeout=QUERY_TIMEOUT)
+        except Exception:
+            _get_pool().put(conn)
+            if owner:
+                _result_cache.release(key, event)
+            raise
+
+        def _close():
+            cur.close()
+            _get_pool().put(conn)
+            if owner:
+                _result_cache.release(key, event)
+
+        on_complete = (lambda b: _result_cache.release(key, event, b)) if owner else None
+        # 查询成功后再开始流式输出；响应关闭时（包括客户端提前断开）归还连接
+        response = Response(_stream_rows(cur, on_complete), mimetype="application/json")
+        response.call_on_close(_close)
+        return response
+    except PoolExhausted as e:
+        log.warning("Rejected query: %s", e)
+        response = _json_response({"error": "Server busy, please retry"}, 503)
+        response.headers["Retry-After"] = "1"
+        return response
+    except _snowflake().errors.Error as e:
         log.error("Query failed: %s", e)
-        return jsonify({"error": f"Snowflake error: {e}"}), 500
+        return _json_response({"error": f"Snowflake error: {e}"}, 500)
     except Exception as e:
         log.error("Error during query execution: %s", e)
-        return jsonify({"error": str(e)}), 500
+        return _json_response({"error": str(e)}, 500)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "10000"))